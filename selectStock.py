@@ -2,8 +2,50 @@ import akshare as ak
 import pandas as pd
 import numpy as np
 import time
+import threading
+import os
 from datetime import datetime, timedelta
 import random
+from concurrent.futures import ThreadPoolExecutor
+
+# 线程安全的令牌桶，所有下载线程共用，把对行情接口的请求速率限制在 rate 次/秒以内
+# 速率自适应：请求失败（多为被限流或超时）时减半，请求成功后逐步恢复到 rate
+class RateLimiter:
+    def __init__(self, rate, capacity=None, min_rate=1):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self, step=0.5):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + step)
+
+# 历史行情接口（ak.stock_zh_a_hist）的全局限速
+HIST_LIMITER = RateLimiter(rate=10)
+
+# 重试前等待：指数退避并加入随机抖动，避免并发任务同时重试
+def backoff_sleep(attempt, base=5, cap=60):
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
 
 # 获取股票信息的函数，增加重试机制
 def get_stock_info_with_retry(retries=5, delay=5):
@@ -13,41 +55,82 @@ def get_stock_info_with_retry(retries=5, delay=5):
             return stock_info
         except Exception as e:
             print(f"获取股票信息失败，重试 {attempt + 1}/{retries}...")
-            time.sleep(delay)
+            if attempt + 1 < retries:
+                backoff_sleep(attempt, base=delay)
     raise Exception("多次重试后仍然无法获取股票信息")
 
+# 本地缓存目录，当天重复运行时直接读取股票代码列表
+CACHE_DIR = "cache"
+
+# 将数据写入本地缓存，写入失败不影响本次运行
+def save_cache(df, cache_path):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        df.to_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"写入缓存失败 {cache_path}：{e}")
+
+# 获取A股代码列表，按日缓存到本地，当天重复运行不再请求全量列表
+def load_stock_info():
+    cache_path = os.path.join(CACHE_DIR, f"stock_info_{datetime.now().strftime('%Y%m%d')}.parquet")
+    if os.path.exists(cache_path):
+        try:
+            return pd.read_parquet(cache_path)
+        except Exception as e:
+            print(f"读取缓存失败 {cache_path}，重新获取。异常：{e}")
+
+    stock_info = get_stock_info_with_retry()
+    save_cache(stock_info, cache_path)
+    return stock_info
+
 # 获取最近60天的股票数据函数
 def get_recent_stock_data(ticker, end):
     start = (datetime.strptime(end, '%Y-%m-%d') - timedelta(days=60)).strftime('%Y%m%d')
     end = end.replace("-", "")
-    stock = ak.stock_zh_a_hist(symbol=ticker, period="daily", start_date=start, end_date=end, adjust="qfq")
-    print(f"Columns for {ticker}: {stock.columns}")
-    stock = stock[['日期', '开盘', '收盘', '最高', '最低', '成交量', '成交额']]
-    stock.columns = ['date', 'open', 'close', 'high', 'low', 'volume', 'amount']
-    stock.set_index('date', inplace=True)
-    stock.index = pd.to_datetime(stock.index)
-    return stock
-
-# 下载股票数据并检查条件
-def check_stocks_for_condition(stock_list, end_date):
-    selected_stocks = []
+    HIST_LIMITER.acquire()
+    try:
+        raw = ak.stock_zh_a_hist(symbol=ticker, period="daily", start_date=start, end_date=end, adjust="qfq")
+    except Exception:
+        HIST_LIMITER.slow_down()
+        raise
+    HIST_LIMITER.speed_up()
+    # 一次性构造结果，避免逐步选列、改名、设索引产生的中间副本
+    return pd.DataFrame({
+        'open': raw['开盘'].to_numpy(),
+        'close': raw['收盘'].to_numpy(),
+        'high': raw['最高'].to_numpy(),
+        'low': raw['最低'].to_numpy(),
+    }, index=pd.DatetimeIndex(raw['日期'].to_numpy(), name='date'))
 
-    for ticker in stock_list:
-        try:
-            stock_df = get_recent_stock_data(ticker, end_date)
-            stock_df['ma5'] = stock_df['close'].rolling(window=5).mean()
-            stock_df['ma30'] = stock_df['close'].rolling(window=30).mean()
+# 检查单只股票是否出现 ma5 上穿 ma30
+def check_stock_condition(ticker, end_date):
+    stock_df = get_recent_stock_data(ticker, end_date)
+    stock_df['ma5'] = stock_df['close'].rolling(window=5).mean()
+    stock_df['ma30'] = stock_df['close'].rolling(window=30).mean()
 
-            if len(stock_df) < 30:
-                continue  # 确保有足够的数据计算均线
+    if len(stock_df) < 30:
+        return False  # 确保有足够的数据计算均线
 
-            yesterday = stock_df.iloc[-2]
-            today = stock_df.iloc[-1]
+    yesterday = stock_df.iloc[-2]
+    today = stock_df.iloc[-1]
 
-            if yesterday['ma5'] <= yesterday['ma30'] and today['ma5'] > today['ma30']:
-                selected_stocks.append(ticker)
-        except Exception as e:
-            print(f"Error processing {ticker}: {e}")
+    return yesterday['ma5'] <= yesterday['ma30'] and today['ma5'] > today['ma30']
+
+# 下载股票数据并检查条件（网络请求为 I/O 密集型，使用线程池并发处理）
+def check_stocks_for_condition(stock_list, end_date, max_workers=16):
+    selected_stocks = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(check_stock_condition, ticker, end_date) for ticker in stock_list]
+        # 按提交顺序收集结果，保持输出顺序与输入一致
+        for ticker, future in zip(stock_list, futures):
+            try:
+                if future.result():
+                    selected_stocks.append(ticker)
+            except Exception as e:
+                print(f"Error processing {ticker}: {e}")
 
     return selected_stocks
 
@@ -56,21 +139,21 @@ def main(num_stocks=1000):
     current_date = datetime.now().strftime('%Y-%m-%d')
 
     # 获取所有A股股票代码
-    stock_info = get_stock_info_with_retry()
+    stock_info = load_stock_info()
     stock_list = stock_info['code'].tolist()
     stock_names = stock_info['name'].tolist()
 
     # 随机选择指定数量的股票
-    selected_indices = random.sample(range(len(stock_list)), num_stocks)
+    selected_indices = np.random.default_rng().choice(len(stock_list), size=num_stocks, replace=False)
     selected_stocks = [stock_list[i] for i in selected_indices]
 
     # 检查符合条件的股票
     selected_stocks = check_stocks_for_condition(selected_stocks, current_date)
 
-    # 打印符合条件的股票代码和名称
+    # 打印符合条件的股票代码和名称（代码到名称的映射只构建一次）
+    code_to_name = dict(zip(stock_list, stock_names))
     for stock in selected_stocks:
-        stock_name = stock_info[stock_info['code'] == stock]['name'].values[0]
-        print(f"Stock: {stock}, Name: {stock_name}")
+        print(f"Stock: {stock}, Name: {code_to_name[stock]}")
 
 if __name__ == "__main__":
     main()
@@ -3,8 +3,81 @@ import pandas as pd
 import numpy as np
 import random
 import time
+import threading
 import json
-from datetime import datetime, timedelta
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+try:
+    from numba import njit, types
+
+    HAS_NUMBA = True
+    # 模拟内核的显式签名；pandas 可能返回只读视图，输入数组统一声明为只读
+    _ro_f4 = types.Array(types.float32, 1, 'A', readonly=True)
+    _SIMULATE_SIGNATURE = types.Tuple((
+        types.int64, types.int64[:], types.int8[:], types.int64[:], types.float64[:], types.float64[:],
+        types.float64, types.int64,
+    ))(_ro_f4, _ro_f4, _ro_f4, types.Array(types.boolean, 1, 'A', readonly=True),
+       types.Array(types.int64, 1, 'A', readonly=True), types.float64, types.float64, types.float64, types.int64)
+except ImportError:
+    # 未安装 numba 时退化为普通 Python 函数
+    HAS_NUMBA = False
+    _SIMULATE_SIGNATURE = None
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+try:
+    import bottleneck as bn
+
+    HAS_BOTTLENECK = True
+except ImportError:
+    # 未安装 bottleneck 时退化为 pandas 的滑动均值
+    HAS_BOTTLENECK = False
+
+# 线程安全的令牌桶，所有下载线程共用，把对行情接口的请求速率限制在 rate 次/秒以内
+# 速率自适应：请求失败（多为被限流或超时）时减半，请求成功后逐步恢复到 rate
+class RateLimiter:
+    def __init__(self, rate, capacity=None, min_rate=1):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self, step=0.5):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + step)
+
+# 历史行情接口（ak.stock_zh_a_hist）的全局限速
+HIST_LIMITER = RateLimiter(rate=10)
+
+# 历史行情请求的逐次超时（秒）：首次请求快速失败，之后的重试逐步放宽
+HIST_TIMEOUTS = (10, 30, 60)
+
+# 重试前等待：指数退避并加入随机抖动，避免并发任务同时重试
+def backoff_sleep(attempt, base=5, cap=60):
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
 
 # 获取股票信息的函数，增加重试机制
 def get_stock_info_with_retry(retries=5, delay=5):
@@ -14,99 +87,235 @@ def get_stock_info_with_retry(retries=5, delay=5):
             return stock_info
         except Exception as e:
             print(f"获取股票信息失败，重试 {attempt + 1}/{retries}...")
-            time.sleep(delay)
+            if attempt + 1 < retries:
+                backoff_sleep(attempt, base=delay)
     raise Exception("多次重试后仍然无法获取股票信息")
 
-# 获取股票数据函数，增加重试机制
+# 本地缓存目录，重复运行时直接读取已下载的行情数据
+CACHE_DIR = "cache"
+
+# 将数据写入本地缓存，写入失败不影响本次运行
+def save_cache(df, cache_path):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        df.to_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"写入缓存失败 {cache_path}：{e}")
+
+# 获取A股代码列表，按日缓存到本地，当天重复运行不再请求全量列表
+def load_stock_info():
+    cache_path = os.path.join(CACHE_DIR, f"stock_info_{datetime.now().strftime('%Y%m%d')}.parquet")
+    if os.path.exists(cache_path):
+        try:
+            return pd.read_parquet(cache_path)
+        except Exception as e:
+            print(f"读取缓存失败 {cache_path}，重新获取。异常：{e}")
+
+    stock_info = get_stock_info_with_retry()
+    save_cache(stock_info, cache_path)
+    return stock_info
+
+# 获取股票数据函数，增加重试机制，优先读取本地缓存
 def get_stock_data_with_retry(ticker, name, start, end, retries=5, delay=5):
+    start = start.replace("-", "")
+    end = end.replace("-", "")
+    cache_path = os.path.join(CACHE_DIR, f"{ticker}_{start}_{end}.parquet")
+    if os.path.exists(cache_path):
+        try:
+            return pd.read_parquet(cache_path)
+        except Exception as e:
+            print(f"读取缓存失败 {cache_path}，重新下载。异常：{e}")
+
     for attempt in range(retries):
         try:
-            start = start.replace("-", "")
-            end = end.replace("-", "")
-            stock = ak.stock_zh_a_hist(symbol=ticker, period="daily", start_date=start, end_date=end, adjust="qfq")
-            stock = stock[['日期', '开盘', '收盘', '最高', '最低', '成交量', '成交额']]
-            stock.columns = ['date', 'open', 'close', 'high', 'low', 'volume', 'amount']
-            stock.set_index('date', inplace=True)
-            stock.index = pd.to_datetime(stock.index)
-            stock['name'] = name
-            return stock
+            HIST_LIMITER.acquire()
+            timeout = HIST_TIMEOUTS[min(attempt, len(HIST_TIMEOUTS) - 1)]
+            raw = ak.stock_zh_a_hist(symbol=ticker, period="daily", start_date=start, end_date=end, adjust="qfq",
+                                     timeout=timeout)
+            HIST_LIMITER.speed_up()
+            break
         except Exception as e:
+            HIST_LIMITER.slow_down()
             print(f"下载股票数据失败 {ticker}，重试 {attempt + 1}/{retries}...")
-            time.sleep(delay)
-    raise Exception(f"多次重试后仍然无法下载股票数据 {ticker}")
-
-# 下载股票数据，增加异常处理
-def download_stock_data(tickers, names, start_date, end_date):
+            if attempt + 1 < retries:
+                backoff_sleep(attempt, base=delay)
+    else:
+        raise Exception(f"多次重试后仍然无法下载股票数据 {ticker}")
+
+    try:
+        # 一次性构造结果，避免逐步选列、改名、设索引产生的中间副本；价格以 float32 存储
+        stock = pd.DataFrame({
+            'open': raw['开盘'].to_numpy(np.float32),
+            'close': raw['收盘'].to_numpy(np.float32),
+            'high': raw['最高'].to_numpy(np.float32),
+            'low': raw['最低'].to_numpy(np.float32),
+            'name': name,
+        }, index=pd.DatetimeIndex(raw['日期'].to_numpy(), name='date'))
+    except KeyError as e:
+        # 返回的数据缺少字段（如代码无效或已退市返回空表），重试也不会成功，直接失败
+        raise Exception(f"股票数据缺少字段 {ticker}：{e}")
+
+    save_cache(stock, cache_path)
+    return stock
+
+# 下载股票数据，增加异常处理（网络请求为 I/O 密集型，使用线程池并发下载）
+# executor 由 main 创建并在所有批次间复用
+def download_stock_data(tickers, names, start_date, end_date, executor):
     stock_data = {}
     total_tickers = len(tickers)
-    for i, (ticker, name) in enumerate(zip(tickers, names), 1):
+    futures = {executor.submit(get_stock_data_with_retry, ticker, name, start_date, end_date): ticker
+               for ticker, name in zip(tickers, names)}
+    for i, future in enumerate(as_completed(futures), 1):
         try:
-            stock_data[ticker] = get_stock_data_with_retry(ticker, name, start_date, end_date)
+            stock_data[futures[future]] = future.result()
             print(f"Downloaded {i}/{total_tickers} stocks")
         except Exception as e:
             print(f"下载股票数据失败，提前结束模拟。异常：{e}")
+            for pending in futures:
+                pending.cancel()
             return stock_data, False  # 提前结束
-    return stock_data, True
-
-# 模拟交易策略函数
-def simulate_strategy(stock_df, ma_short, ma_long, up_ratio, down_ratio, initial_balance=100000):
-    balance = initial_balance
+    # 按原始顺序排列，保证输出稳定
+    return {ticker: stock_data[ticker] for ticker in tickers}, True
+
+# 交易状态机内核，只接受 NumPy 数组，可由 numba 编译为机器码
+# 显式给出签名，导入时即完成编译并写入磁盘缓存，多个策略和子进程复用同一份机器码
+@njit(_SIMULATE_SIGNATURE, cache=True)
+def _simulate_kernel(open_, high, low, buy_signal, days, initial_balance, up_ratio, down_ratio, cooldown_days):
+    n = len(open_)
+    trans_idx = np.empty(n, np.int64)
+    trans_type = np.empty(n, np.int8)  # 0 买入，1 卖出
+    trans_shares = np.empty(n, np.int64)
+    trans_price = np.empty(n, np.float64)
+    trans_balance = np.empty(n, np.float64)
+    k = 0
+
+    # 行情为 float32，余额与成交价按 float64 计算以保证金额精度，持股数量保持 int64
+    balance = np.float64(initial_balance)
     shares = 0
-    transactions = []
-    buy_price = 0
+    buy_price = 0.0
     consecutive_losses = 0
-    last_loss_date = None
-
-    stock_df[f'ma{ma_short}'] = stock_df['close'].rolling(window=ma_short).mean()
-    stock_df[f'ma{ma_long}'] = stock_df['close'].rolling(window=ma_long).mean()
-
-    for i in range(1, len(stock_df)):
-        today = stock_df.iloc[i]
-        yesterday = stock_df.iloc[i - 1]
-        day_before_yesterday = stock_df.iloc[i - 2] if i >= 2 else None
-
-        # 判断长均线是否连续3日上涨
-        if i >= 3:
-            last_three_days = stock_df.iloc[i-3:i]
-            ma_long_trend = last_three_days[f'ma{ma_long}'].diff().dropna() > 0
-            is_ma_long_upward = ma_long_trend.all()
-        else:
-            is_ma_long_upward = False
-
-        if last_loss_date is not None and today.name <= last_loss_date + timedelta(days=60):
+    in_cooldown = False
+    last_loss_day = 0
+
+    # 只遍历买入信号所在的交易日，每次买入后直接向后查找与之配对的卖出日，空仓期间的交易日全部跳过
+    next_free = 0  # 空仓后可以再次买入的最早位置
+    for i in np.flatnonzero(buy_signal):
+        if i < next_free:
+            continue  # 仍在持仓中
+        if in_cooldown and days[i] <= last_loss_day + cooldown_days:
             continue  # 如果在两个月内，不进行交易
 
-        if day_before_yesterday is not None and day_before_yesterday[f'ma{ma_short}'] < day_before_yesterday[f'ma{ma_long}'] and yesterday[f'ma{ma_short}'] >= yesterday[f'ma{ma_long}'] and shares == 0:
-            # 买入信号（以今天开盘价买入）
-            buy_price = today['open']
-            shares_to_buy = (balance // buy_price) // 100 * 100  # 使买入的数量是100的整数倍
-            cost = shares_to_buy * buy_price
-            balance -= cost
-            shares += shares_to_buy
-            print(f"{today.name.date()}, B, {shares_to_buy}, {buy_price:.2f}, {balance:.2f}")
-        elif shares > 0 and (today['high'] >= (1 + up_ratio) * buy_price or today['low'] <= (1 - down_ratio) * buy_price):
-            # 卖出信号（当日最高价达到上涨比例时卖出）
-            if today['high'] >= (1 + up_ratio) * buy_price:
-                sell_price = (1 + up_ratio) * buy_price  # 设定卖出价格为涨幅比例
-            else:
-                sell_price = (1 - down_ratio) * buy_price
-            income = shares * sell_price
-            balance += income
-            print(f"{today.name.date()}, S, {shares}, {sell_price:.2f}, {balance:.2f}")
-            shares = 0
-
-            # 计算是否亏损
-            if sell_price < buy_price:
-                consecutive_losses += 1
-                if consecutive_losses >= 2:
-                    last_loss_date = today.name
-            else:
-                consecutive_losses = 0
+        # 买入信号（以今天开盘价买入）
+        buy_price = float(open_[i])
+        shares_to_buy = int(balance // buy_price) // 100 * 100  # 使买入的数量是100的整数倍
+        balance -= shares_to_buy * buy_price
+        shares += shares_to_buy
+        trans_idx[k] = i
+        trans_type[k] = 0
+        trans_shares[k] = shares_to_buy
+        trans_price[k] = buy_price
+        trans_balance[k] = balance
+        k += 1
+        next_free = i + 1
+        if shares == 0:
+            continue
+
+        # 卖出信号：买入后第一个最高价达到上涨比例或最低价跌破下跌比例的交易日
+        up_price = (1 + up_ratio) * buy_price
+        down_price = (1 - down_ratio) * buy_price
+        j = i + 1
+        while j < n and not (high[j] >= up_price or low[j] <= down_price):
+            j += 1
+        if j == n:
+            break  # 持有至数据结束
+
+        if high[j] >= up_price:
+            sell_price = up_price  # 设定卖出价格为涨幅比例
+        else:
+            sell_price = down_price
+        balance += shares * sell_price
+        trans_idx[k] = j
+        trans_type[k] = 1
+        trans_shares[k] = shares
+        trans_price[k] = sell_price
+        trans_balance[k] = balance
+        k += 1
+        shares = 0
+        next_free = j + 1
+
+        # 计算是否亏损
+        if sell_price < buy_price:
+            consecutive_losses += 1
+            if consecutive_losses >= 2:
+                in_cooldown = True
+                last_loss_day = days[j]
+        else:
+            consecutive_losses = 0
+
+    return k, trans_idx, trans_type, trans_shares, trans_price, trans_balance, balance, shares
+
+# 将整批股票的收盘价排成一个面板（每行一只股票，右对齐，左侧用 NaN 补齐），
+# 一次计算出各个窗口的均线，供同一批数据上的所有策略复用
+def compute_panel_ma(all_stock_data, windows):
+    if not all_stock_data:
+        return {}
+    lengths = [len(stock_df) for stock_df in all_stock_data.values()]
+    width = max(lengths)
+    close = np.full((len(lengths), width), np.nan, dtype=np.float32)
+    for row, (stock_df, n) in enumerate(zip(all_stock_data.values(), lengths)):
+        close[row, width - n:] = stock_df['close'].to_numpy(np.float32)
+
+    return {w: move_mean(close, w) for w in windows}
+
+# 按行计算滑动窗口均值，窗口未满的位置为 NaN，各股票之间互不影响
+def move_mean(close, window):
+    # 窗口超过本批最长数据时 bn.move_mean 会报错，此时均线全部为 NaN（不产生买入信号）
+    if window > close.shape[1]:
+        return np.full(close.shape, np.nan, np.float32)
+    if HAS_BOTTLENECK:
+        return bn.move_mean(close, window=window, min_count=window, axis=1)
+    return pd.DataFrame(close.T).rolling(window, min_periods=window).mean().to_numpy(np.float32).T
+
+# 根据面板均线一次向量化计算得到所有股票的均线交叉买入信号
+def compute_buy_signals(all_stock_data, panel_ma, ma_short, ma_long):
+    if not all_stock_data:
+        return {}
+    ma_s = panel_ma[ma_short]
+    ma_l = panel_ma[ma_long]
+
+    # 买入信号：前天短均线在长均线下方，昨天短均线上穿长均线（以今天开盘价买入）
+    signal = np.zeros(ma_s.shape, dtype=bool)
+    signal[:, 2:] = (ma_s[:, :-2] < ma_l[:, :-2]) & (ma_s[:, 1:-1] >= ma_l[:, 1:-1])
+    width = signal.shape[1]
+    return {ticker: signal[row, width - len(stock_df):]
+            for row, (ticker, stock_df) in enumerate(all_stock_data.items())}
 
+# 模拟交易策略函数
+def simulate_strategy(stock_df, buy_signal, up_ratio, down_ratio, initial_balance=100000):
+    # 日期保持为 datetime64[D]，内核中按 int64 天数比较，只在打印时格式化
+    dates = stock_df.index.values.astype('datetime64[D]')
+    days = dates.view(np.int64)
+    inputs = (stock_df['open'].to_numpy(np.float32), stock_df['high'].to_numpy(np.float32),
+              stock_df['low'].to_numpy(np.float32), buy_signal, days)
+    if not HAS_NUMBA:
+        # 内核以纯 Python 运行时，逐元素访问列表比访问 NumPy 数组（每次构造标量对象）快得多
+        inputs = tuple(a.tolist() for a in inputs)
+    k, trans_idx, trans_type, trans_shares, trans_price, trans_balance, balance, shares = _simulate_kernel(
+        *inputs, float(initial_balance), float(up_ratio), float(down_ratio), 60)
+
+    # 以数组形式返回交易记录（日期、类型、数量、价格、余额），打印时再逐条格式化
+    transactions = (dates[trans_idx[:k]], trans_type[:k], trans_shares[:k],
+                    trans_price[:k], trans_balance[:k])
     return transactions, balance, shares
 
-# 执行策略函数
-def execute_strategy(strategy, all_stock_data, results):
+# 在子进程中模拟单只股票，各股票之间互不依赖
+def _run_one(stock_df, buy_signal, up_ratio, down_ratio):
+    return simulate_strategy(stock_df, buy_signal, up_ratio, down_ratio)
+
+# 执行策略函数（executor 为 main 中创建的进程池，所有批次和策略共用）
+def execute_strategy(strategy, all_stock_data, panel_ma, results, executor):
     ma_short = strategy['ma_short']
     ma_long = strategy['ma_long']
     up_ratio = strategy['up_ratio']
@@ -126,12 +335,29 @@ def execute_strategy(strategy, all_stock_data, results):
     total_profit = 0
     total_loss = 0
 
-    for ticker, stock_data in all_stock_data.items():
+    num_simulated = 0
+    log_buf = []  # 输出先缓存在内存中，最后一次性写出
+    buy_signals = compute_buy_signals(all_stock_data, panel_ma, ma_short, ma_long)
+
+    futures = {executor.submit(_run_one, stock_data, buy_signals[ticker], up_ratio, down_ratio): ticker
+               for ticker, stock_data in all_stock_data.items()}
+    # 按提交顺序收集结果，保证输出顺序和累计结果在多次运行间保持一致
+    for future, ticker in futures.items():
+        try:
+            transactions, final_balance, shares = future.result()
+        except Exception as e:
+            log_buf.append(f"模拟股票 {ticker} 失败，跳过。异常：{e}")
+            continue
+        num_simulated += 1
+        stock_data = all_stock_data[ticker]
         stock_name = stock_data['name'].iloc[0]
-        transactions, final_balance, shares = simulate_strategy(stock_data, ma_short, ma_long, up_ratio, down_ratio)
+
+        trans_dates, *trans_fields = transactions
+        for date, kind, trade_shares, price, balance in zip(np.datetime_as_string(trans_dates), *trans_fields):
+            log_buf.append(f"{date}, {'B' if kind == 0 else 'S'}, {trade_shares}, {price:.2f}, {balance:.2f}")
 
         # 计算截止到当前日期的股票市值
-        current_stock_price = stock_data['close'].iloc[-1]
+        current_stock_price = float(stock_data['close'].iloc[-1])  # 按 float64 计算市值
         stock_value = shares * current_stock_price
 
         # 累计总现金和股票市值
@@ -150,11 +376,14 @@ def execute_strategy(strategy, all_stock_data, results):
             total_loss += profit_or_loss
 
         # 打印每只股票的买卖结果
-        print(f"{ticker} ({stock_name}) Initial Balance: 100000.00")
-        print(f"{ticker} ({stock_name}) Final Balance: {final_balance:.2f}")
-        print(f"{ticker} ({stock_name}) Stock Value: {stock_value:.2f}")
-        print(f"{ticker} ({stock_name}) Total Profit/Loss: {profit_or_loss:.2f}")
-        print("===")
+        log_buf.append(f"{ticker} ({stock_name}) Initial Balance: 100000.00")
+        log_buf.append(f"{ticker} ({stock_name}) Final Balance: {final_balance:.2f}")
+        log_buf.append(f"{ticker} ({stock_name}) Stock Value: {stock_value:.2f}")
+        log_buf.append(f"{ticker} ({stock_name}) Total Profit/Loss: {profit_or_loss:.2f}")
+        log_buf.append("===")
+
+    if log_buf:
+        sys.stdout.write("\n".join(log_buf) + "\n")
 
     # 合并统计结果
     if strategy['name'] not in results:
@@ -172,7 +401,7 @@ def execute_strategy(strategy, all_stock_data, results):
     results[strategy['name']]['total_cash'] += total_cash
     results[strategy['name']]['total_stock_value'] += total_stock_value
     results[strategy['name']]['total_value'] += total_cash + total_stock_value
-    results[strategy['name']]['num_stocks'] += len(all_stock_data)
+    results[strategy['name']]['num_stocks'] += num_simulated
     results[strategy['name']]['num_profitable'] += num_profitable
     results[strategy['name']]['num_loss'] += num_loss
     results[strategy['name']]['total_profit'] += total_profit
@@ -189,33 +418,41 @@ def main():
     strategies = {k: v for k, v in config.items() if k.startswith("strategy")}
     results = {}
 
+    # 所有策略用到的均线窗口，每批数据只计算一次（非法窗口留给 execute_strategy 报错）
+    windows = {strat[key] for strat in strategies.values() for key in ('ma_short', 'ma_long') if strat[key] >= 1}
+
     current_date = datetime.now().strftime('%Y-%m-%d')
 
     # 获取所有A股股票代码
-    stock_info = get_stock_info_with_retry()
+    stock_info = load_stock_info()
     stock_list = stock_info['code'].tolist()
     stock_names = stock_info['name'].tolist()
 
     # 随机选择指定数量的股票
-    selected_indices = random.sample(range(len(stock_list)), num_stocks)
+    selected_indices = np.random.default_rng().choice(len(stock_list), size=num_stocks, replace=False)
     tickers = [stock_list[i] for i in selected_indices]
     stock_names = [stock_names[i] for i in selected_indices]
 
     batch_size = 50
 
-    for i in range(0, len(tickers), batch_size):
-        batch_tickers = tickers[i:i + batch_size]
-        batch_names = stock_names[i:i + batch_size]
-
-        # 下载当前批次的股票数据
-        all_stock_data, success = download_stock_data(batch_tickers, batch_names, init_date, current_date)
-        if not success:
-            break  # 如果下载失败，提前结束模拟
-
-        for strategy_name, strat in strategies.items():
-            print(f"Executing {strategy_name} for batch {i // batch_size + 1}...")
-            strat['name'] = strategy_name  # 添加策略名称到策略对象
-            execute_strategy(strat, all_stock_data, results)
+    # 下载线程池和模拟进程池只创建一次，所有批次和策略复用，避免反复创建和销毁工作进程
+    with ThreadPoolExecutor(max_workers=16) as download_executor, \
+            ProcessPoolExecutor(max_workers=os.cpu_count()) as simulate_executor:
+        for i in range(0, len(tickers), batch_size):
+            batch_tickers = tickers[i:i + batch_size]
+            batch_names = stock_names[i:i + batch_size]
+
+            # 下载当前批次的股票数据
+            all_stock_data, success = download_stock_data(batch_tickers, batch_names, init_date, current_date,
+                                                          download_executor)
+            if not success:
+                break  # 如果下载失败，提前结束模拟
+            panel_ma = compute_panel_ma(all_stock_data, windows)
+
+            for strategy_name, strat in strategies.items():
+                print(f"Executing {strategy_name} for batch {i // batch_size + 1}...")
+                strat['name'] = strategy_name  # 添加策略名称到策略对象
+                execute_strategy(strat, all_stock_data, panel_ma, results, simulate_executor)
 
     # 打印所有策略的合并结果
     print("\nAll Strategies Results:")